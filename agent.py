@@ -6,6 +6,13 @@ DIRECTIONS = [[0, -1], [0, 1], [-1, 0], [1, 0]]
 
 VALUES = {"0": 0, "G": 1, "R": 2, "S": 3, "g": 4}
 
+# Actions allowed by each bit mask of safe actions, none safe allows all
+SAFE_ACTIONS = [
+    tuple(action for action in range(len(ACTIONS)) if mask >> action & 1)
+    or tuple(range(len(ACTIONS)))
+    for mask in range(1 << len(ACTIONS))
+]
+
 
 class Agent:
 
@@ -15,23 +22,22 @@ class Agent:
         self.decay = decay
 
         self.states = []
+        self.rng = numpy.random.default_rng()
 
     def choose_direction(self, state):
         state_serial_number, possible_directions, lowest_reward = state
 
         if random.uniform(0, 1) < self.exploration_rate:
-            action = random.randrange(0, len(possible_directions))
-
-            # If choosing an action that will instantly lose,
-            # choose something else instead
-            attempts = 0
-            while (
-                self.states[state_serial_number][action]
-                < lowest_reward * self.learning_rate * self.decay
-                and attempts < 100
+            # Explore among the actions that do not look like an instant
+            # loss, or all of them if they all do
+            threshold = lowest_reward * self.learning_rate * self.decay
+            safe = 0
+            for index, score in enumerate(
+                self.states[state_serial_number].tolist()
             ):
-                action = random.randrange(0, len(possible_directions))
-                attempts += 1
+                if score >= threshold:
+                    safe |= 1 << index
+            action = random.choice(SAFE_ACTIONS[safe])
         else:
             action = numpy.argmax(self.states[state_serial_number])
 
@@ -55,3 +61,53 @@ class Agent:
             self.learning_rate
             * (reward + (self.decay * max_score_after_action))
         )
+
+    def choose_actions(self, state_serial_numbers, lowest_reward=None):
+        # Batched choice for live states, returns columns of the Q table
+        state_serial_numbers = numpy.asarray(state_serial_numbers)
+        actions = numpy.argmax(self.states[state_serial_numbers], axis=1)
+
+        explore = self.rng.random(len(actions)) < self.exploration_rate
+        keys = self.rng.random((numpy.count_nonzero(explore), len(ACTIONS)))
+
+        # Same as the single choice, losing actions never win the draw
+        # unless every action is losing
+        if lowest_reward is not None:
+            threshold = lowest_reward * self.learning_rate * self.decay
+            safe = self.states[state_serial_numbers[explore]] >= threshold
+            safe[~safe.any(axis=1)] = True
+            keys[~safe] = -1
+
+        actions[explore] = numpy.argmax(keys, axis=1)
+        return actions
+
+    def update_states_batch(
+        self, previous_states, new_states, actions, rewards
+    ):
+        previous_states = numpy.asarray(previous_states)
+        new_states = numpy.asarray(new_states)
+        actions = numpy.asarray(actions)
+
+        # Lost games have a negative serial number that is their own score
+        lost = new_states < 0
+        max_score_after_action = numpy.where(
+            lost,
+            new_states,
+            self.states[numpy.where(lost, 0, new_states)].max(axis=1),
+        )
+
+        score_before_action = self.states[previous_states, actions]
+        new_scores = (self.learning_rate * score_before_action) + (
+            self.learning_rate
+            * (numpy.asarray(rewards) + (self.decay * max_score_after_action))
+        )
+
+        # Transitions hitting the same entry move it by the average of their
+        # updates instead of the last one winning
+        entries = previous_states * self.states.shape[1] + actions
+        entries, inverse = numpy.unique(entries, return_inverse=True)
+        changes = numpy.zeros(len(entries))
+        numpy.add.at(changes, inverse, new_scores - score_before_action)
+        changes /= numpy.bincount(inverse)
+
+        self.states.reshape(-1)[entries] += changes
@@ -0,0 +1,212 @@
+import numpy
+
+from board import BODY, CELL_CODES, EMPTY, GREEN, HEAD, RED
+
+NOTHING, ATE_GREEN, ATE_RED, LOST = range(4)
+OUTCOME_CODES = ["0", "G", "R", "L"]
+
+DIRECTIONS = [[0, -1], [0, 1], [-1, 0], [1, 0]]
+
+
+class BatchBoard:
+    def __init__(
+        self,
+        count=64,
+        board_size=10,
+        green_apples_count=2,
+        red_apples_count=1,
+        snake_size=3,
+        seed=False,
+    ):
+        self.count = count
+        self.board_size = board_size
+        self.snake_size = snake_size
+        self.green_apples_count = green_apples_count
+        self.red_apples_count = red_apples_count
+
+        self.rng = numpy.random.default_rng(None if seed is False else seed)
+
+        self.area = numpy.full(
+            (count, board_size, board_size), EMPTY, dtype=numpy.uint8
+        )
+        self.lost = numpy.zeros(count, dtype=bool)
+
+        # Snake bodies are ring buffers, segment k of board i lives at
+        # snake_body[i, (snake_head[i] + k) % capacity]
+        self.capacity = board_size * board_size + 1
+        self.snake_body = numpy.zeros((count, self.capacity, 2), dtype=int)
+        self.snake_head = numpy.zeros(count, dtype=int)
+        self.snake_length = numpy.zeros(count, dtype=int)
+
+        self.apple_codes = numpy.array(
+            [GREEN] * green_apples_count + [RED] * red_apples_count,
+            dtype=numpy.uint8,
+        )
+        self.apples_pos = numpy.full((count, len(self.apple_codes), 2), -1)
+
+        self.reset_boards()
+
+    def reset_boards(self, indices=None):
+        if indices is None:
+            indices = range(self.count)
+
+        for index in indices:
+            self.area[index] = EMPTY
+            self.lost[index] = False
+            self.init_snake(index)
+            self.init_apples(index)
+
+    def reset_lost(self):
+        lost = numpy.flatnonzero(self.lost)
+        self.reset_boards(lost)
+        return lost
+
+    def init_snake(self, index):
+        body = []
+        while len(body) < self.snake_size:
+            # Random walk from a random head, restarting when cornered
+            body = [tuple(self.rng.integers(0, self.board_size, 2))]
+            while len(body) < self.snake_size:
+                options = [
+                    (body[-1][0] + direction[0], body[-1][1] + direction[1])
+                    for direction in DIRECTIONS
+                ]
+                options = [
+                    pos
+                    for pos in options
+                    if 0 <= pos[0] < self.board_size
+                    and 0 <= pos[1] < self.board_size
+                    and pos not in body
+                ]
+                if not options:
+                    break
+                body.append(options[self.rng.integers(len(options))])
+
+        self.snake_head[index] = 0
+        self.snake_length[index] = len(body)
+        self.snake_body[index, : len(body)] = body
+
+        for x, y in body:
+            self.area[index, x, y] = BODY
+        self.area[index, body[0][0], body[0][1]] = HEAD
+
+    def init_apples(self, index):
+        for slot, code in enumerate(self.apple_codes):
+            free = numpy.flatnonzero(self.area[index] == EMPTY)
+            if free.size == 0:
+                self.apples_pos[index, slot] = [-1, -1]
+                continue
+            x, y = divmod(free[self.rng.integers(free.size)], self.board_size)
+            self.apples_pos[index, slot] = [x, y]
+            self.area[index, x, y] = code
+
+    def respawn_apples(self, boards, eaten_pos):
+        slots = numpy.argmax(
+            (self.apples_pos[boards] == eaten_pos[:, None, :]).all(axis=2),
+            axis=1,
+        )
+
+        # Pick a uniformly random empty cell on every board at once
+        free = self.area[boards].reshape(len(boards), -1) == EMPTY
+        draws = self.rng.random(free.shape)
+        draws[~free] = -1
+        cells = numpy.argmax(draws, axis=1)
+        x, y = numpy.divmod(cells, self.board_size)
+
+        has_free = free.any(axis=1)
+        codes = self.apple_codes[slots]
+        self.area[boards[has_free], x[has_free], y[has_free]] = codes[has_free]
+        self.apples_pos[boards, slots] = numpy.where(
+            has_free[:, None], numpy.stack([x, y], axis=1), -1
+        )
+
+    def move_snake(self, directions):
+        directions = numpy.asarray(directions)
+        outcomes = numpy.full(self.count, LOST, dtype=numpy.uint8)
+
+        boards = numpy.flatnonzero(~self.lost)
+        if boards.size == 0:
+            return outcomes
+
+        head_index = self.snake_head[boards]
+        length = self.snake_length[boards]
+        tail_index = (head_index + length - 1) % self.capacity
+
+        heads = self.snake_body[boards, head_index]
+        tails = self.snake_body[boards, tail_index]
+        new_heads = heads + directions[boards]
+
+        out_of_bounds = ((new_heads < 0) | (new_heads >= self.board_size)).any(
+            axis=1
+        )
+        clipped = numpy.clip(new_heads, 0, self.board_size - 1)
+        target = self.area[boards, clipped[:, 0], clipped[:, 1]]
+        target[out_of_bounds] = EMPTY
+
+        ate_green = target == GREEN
+        ate_red = target == RED
+
+        # The tail moves away this step, so only the rest of the body counts
+        hit_tail = (target == BODY) & (new_heads != tails).any(axis=1)
+        too_small = ate_red & (length <= 1)
+
+        lost = out_of_bounds | hit_tail | too_small
+        self.lost[boards[lost]] = True
+
+        moving = ~lost
+        boards = boards[moving]
+        head_index = head_index[moving]
+        length = length[moving]
+        heads = heads[moving]
+        new_heads = new_heads[moving]
+        ate_green = ate_green[moving]
+        ate_red = ate_red[moving]
+
+        self.area[boards, heads[:, 0], heads[:, 1]] = BODY
+
+        # Respawn before the tail moves, the vacated cell is not free yet
+        eaten = ate_green | ate_red
+        if eaten.any():
+            self.respawn_apples(boards[eaten], new_heads[eaten])
+
+        popped = ~ate_green
+        tails = self.snake_body[
+            boards[popped],
+            (head_index[popped] + length[popped] - 1) % self.capacity,
+        ]
+        self.area[boards[popped], tails[:, 0], tails[:, 1]] = EMPTY
+
+        tails = self.snake_body[
+            boards[ate_red],
+            (head_index[ate_red] + length[ate_red] - 2) % self.capacity,
+        ]
+        self.area[boards[ate_red], tails[:, 0], tails[:, 1]] = EMPTY
+
+        head_index = (head_index - 1) % self.capacity
+        self.snake_head[boards] = head_index
+        self.snake_body[boards, head_index] = new_heads
+        self.snake_length[boards] = length + ate_green - ate_red
+        self.area[boards, new_heads[:, 0], new_heads[:, 1]] = HEAD
+
+        outcomes[boards] = numpy.where(
+            ate_green, ATE_GREEN, numpy.where(ate_red, ATE_RED, NOTHING)
+        )
+        return outcomes
+
+    def snake_pos(self, index):
+        positions = (
+            self.snake_head[index] + numpy.arange(self.snake_length[index])
+        ) % self.capacity
+        return self.snake_body[index, positions].tolist()
+
+    def display_area_cli(self, index):
+        displayed_board = numpy.array(CELL_CODES)[self.area[index].T]
+
+        print("W" * (self.board_size + 2))
+        for column in displayed_board:
+            print("W" + "".join(column) + "W")
+        print("W" * (self.board_size + 2))
+
+
+if __name__ == "__main__":
+    boards = BatchBoard()
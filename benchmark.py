@@ -0,0 +1,290 @@
+import board
+import interpreter
+import learn2slither
+import numpy
+import json
+import platform
+import random
+import sys
+import time
+
+import argparse
+
+DIRECTIONS = [[0, -1], [0, 1], [-1, 0], [1, 0]]
+
+
+def measure(function, iterations, repeat=3):
+    # Best of a few runs, in seconds per call
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        elapsed = (time.perf_counter() - start) / iterations
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def result(seconds_per_call, **parameters):
+    return dict(
+        parameters,
+        per_second=1 / seconds_per_call,
+        latency_us=seconds_per_call * 1e6,
+    )
+
+
+def board_cycle(board_size):
+    # A loop through every cell, board_size must be even
+    cycle = [(x, 0) for x in range(board_size)]
+    for column, x in enumerate(range(board_size - 1, -1, -1)):
+        rows = range(1, board_size)
+        cycle += [(x, y) for y in (rows if column % 2 == 0 else rows[::-1])]
+    return cycle
+
+
+def bench_move_snake(board_size, snake_length, iterations):
+    game = board.Board(
+        board_size=board_size, green_apples_count=0, red_apples_count=0
+    )
+    cycle = board_cycle(board_size)
+    game.set_positions(cycle[:snake_length][::-1], [], [])
+
+    moves = [
+        [
+            cycle[(index + 1) % len(cycle)][axis] - cycle[index][axis]
+            for axis in range(2)
+        ]
+        for index in range(len(cycle))
+    ]
+    step = [snake_length - 1]
+
+    def move():
+        game.move_snake(moves[step[0] % len(moves)])
+        step[0] += 1
+
+    return result(
+        measure(move, iterations),
+        board_size=board_size,
+        snake_length=snake_length,
+    )
+
+
+def random_boards(board_size, count):
+    games = []
+    for seed in range(1, count + 1):
+        game = board.Board(board_size=board_size, seed=seed)
+        for _ in range(seed % 7):
+            if not game.lost:
+                game.move_snake(random.choice(DIRECTIONS))
+        if not game.lost:
+            games.append(game)
+    return games
+
+
+def bench_calculate_state(board_size, vision_length, iterations):
+    state_interpreter = interpreter.Interpreter(vision_length)
+    games = random_boards(board_size, 64)
+    index = [0]
+
+    def calculate():
+        state_interpreter.calculate_state(games[index[0] % len(games)])
+        index[0] += 1
+
+    return result(
+        measure(calculate, iterations),
+        board_size=board_size,
+        vision_length=vision_length,
+    )
+
+
+def bench_agent(iterations):
+    learner = learn2slither.Qlearner()
+    states = [
+        (int(state), ("U", "D", "L", "R"), interpreter.REWARDS["L"])
+        for state in numpy.random.default_rng(1).integers(
+            0, len(learner.agent.states), 1024
+        )
+    ]
+    index = [0]
+
+    def choose():
+        learner.agent.choose_direction(states[index[0] % len(states)])
+        index[0] += 1
+
+    def update():
+        learner.agent.update_states(
+            states[index[0] % len(states)],
+            states[(index[0] + 1) % len(states)],
+            index[0] % 4,
+            -5,
+        )
+        index[0] += 1
+
+    # Batched calls, timed per transition
+    batch = numpy.array([state[0] for state in states])
+    actions = batch % 4
+    rewards = numpy.full(len(batch), -5.0)
+    batch_iterations = max(iterations // len(batch), 10)
+
+    def choose_batch():
+        learner.agent.choose_actions(batch, interpreter.REWARDS["L"])
+
+    def update_batch():
+        learner.agent.update_states_batch(
+            batch, numpy.roll(batch, 1), actions, rewards
+        )
+
+    return [
+        result(measure(choose, iterations), function="choose_direction"),
+        result(measure(update, iterations), function="update_states"),
+        result(
+            measure(choose_batch, batch_iterations) / len(batch),
+            function="choose_actions",
+        ),
+        result(
+            measure(update_batch, batch_iterations) / len(batch),
+            function="update_states_batch",
+        ),
+    ]
+
+
+def bench_episodes(board_size, episodes):
+    learner = learn2slither.Qlearner(
+        argboard=board.Board(board_size=board_size)
+    )
+
+    steps = 0
+    start = time.perf_counter()
+    for seed in range(1, episodes + 1):
+        learner.board = board.Board(board_size=board_size, seed=seed)
+        learner.inputs = bytearray()
+        lifetime = 0
+        while not learner.board.lost and lifetime < learner.max_epoch:
+            learner.new_step()
+            lifetime += 1
+        steps += lifetime
+    elapsed = time.perf_counter() - start
+
+    return {
+        "board_size": board_size,
+        "episodes_per_second": episodes / elapsed,
+        "steps_per_second": steps / elapsed,
+    }
+
+
+def run(quick=False):
+    scale = 0.1 if quick else 1
+    iterations = max(int(20000 * scale), 100)
+    random.seed(1)
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "platform": platform.platform(),
+        },
+        "move_snake": [
+            bench_move_snake(board_size, snake_length, iterations)
+            for board_size in (10, 20, 30)
+            for snake_length in (3, 20, 60)
+            if snake_length < board_size * board_size // 2
+        ],
+        "calculate_state": [
+            bench_calculate_state(board_size, vision_length, iterations)
+            for board_size in (10, 30)
+            for vision_length in (1, 3, 5)
+        ],
+        "agent": bench_agent(iterations),
+        "episodes": [
+            bench_episodes(board_size, max(int(200 * scale), 10))
+            for board_size in (10, 20)
+        ],
+    }
+    return results
+
+
+def rates(results):
+    # Flatten to {benchmark label: throughput}, higher is better
+    flat = {}
+    for name, entries in results.items():
+        if name == "environment":
+            continue
+        for entry in entries:
+            label = ",".join(
+                [name]
+                + [
+                    f"{key}={value}"
+                    for key, value in entry.items()
+                    if not isinstance(value, float)
+                ]
+            )
+            for key, value in entry.items():
+                if key.endswith("per_second"):
+                    flat[f"{label},{key}"] = value
+    return flat
+
+
+def compare(results, baseline, threshold):
+    current = rates(results)
+    regressions = []
+
+    for label, before in rates(baseline).items():
+        if label in current and current[label] < before * (1 - threshold):
+            regressions.append(
+                f"{label}: {before:.1f} -> {current[label]:.1f} "
+                f"({current[label] / before - 1:+.1%})"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Learn2slither benchmarks",
+        description="Measure board, interpreter, agent and episode speed",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=False,
+        help="The file to write the JSON results to",
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        type=str,
+        default=False,
+        help="Results of an earlier run to check for regressions against",
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Slowdown ratio flagged as a regression",
+    )
+    parser.add_argument(
+        "-q",
+        "--quick",
+        action="store_true",
+        help="Run fewer iterations, for smoke testing",
+    )
+
+    args = parser.parse_args()
+
+    results = run(args.quick)
+
+    for label, value in rates(results).items():
+        print(f"{label}: {value:,.1f}")
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, "r") as fd:
+            regressions = compare(results, json.load(fd), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
@@ -1,8 +1,43 @@
 import numpy
-import copy
+import array
+import collections
+import hashlib
 import random
 
-APPLE_CODES = ["G", "R"]
+EMPTY, HEAD, BODY, GREEN, RED = range(5)
+CELL_CODES = ["0", "H", "S", "G", "R"]
+
+APPLE_CODES = [GREEN, RED]
+
+# Immutable and hashable copy of a board, positions are packed as int16
+# pairs and the free cell order (C ints) is kept since apples respawn from it
+BoardSnapshot = collections.namedtuple(
+    "BoardSnapshot",
+    [
+        "board_size",
+        "snake_size",
+        "area",
+        "free_cells",
+        "snake_pos",
+        "green_apples_pos",
+        "red_apples_pos",
+        "lost",
+        "death_cause",
+        "legacy_respawn",
+        "rngseed",
+        "rng_state",
+    ],
+)
+
+
+def codes_from_strings(area):
+    area = numpy.array(area)
+    codes = numpy.full(area.shape, EMPTY, dtype=numpy.uint8)
+
+    for code, cell in enumerate(CELL_CODES):
+        codes[area == cell] = code
+
+    return codes
 
 
 class Board:
@@ -13,16 +48,27 @@ class Board:
         red_apples_count=1,
         snake_size=3,
         seed=False,
+        check_updates=False,
     ):
         self.lost = False
-        self.area = numpy.full((board_size, board_size), "0", dtype=str)
+        self.death_cause = None
+        self.check_updates = check_updates
+        self.revision = 0
+        self.legacy_respawn = False
 
         self.board_size = board_size
+        self.clear_area()
+
+        if seed is False:
+            self.rngseed = random.randrange(0, 100000)
+        else:
+            self.rngseed = seed
 
-        self.rngstate = random.getstate()
+        # Each board owns its generator, so the seed alone decides the game
+        self.rng = random.Random(self.rngseed)
 
         self.snake_size = snake_size
-        self.snake_pos = []
+        self.snake_pos = collections.deque()
         self.init_snake()
 
         self.green_apples_count = green_apples_count
@@ -31,18 +77,12 @@ class Board:
         self.red_apples_pos = numpy.full((red_apples_count, 2), 0)
         self.init_apples()
 
-        if seed:
-            self.rngseed = seed
-        else:
-            self.rngseed = random.randrange(0, 100000)
-
-        random.seed(self.rngseed)
-        self.rngstate = random.getstate()
-
         self.update_area()
 
     def set_board(self, new_board):
-        self.area = numpy.array(new_board["starting_state"])
+        self.revision += 1
+        self.area = codes_from_strings(new_board["starting_state"])
+        self.index_free_cells()
 
         self.snake_pos = []
 
@@ -54,13 +94,13 @@ class Board:
 
         for x, column in enumerate(self.area):
             for y, cell in enumerate(column):
-                if cell == "G":
+                if cell == GREEN:
                     green_apples_pos.append([x, y])
                     self.green_apples_count += 1
-                if cell == "R":
+                if cell == RED:
                     red_apples_pos.append([x, y])
                     self.red_apples_count += 1
-                if cell == "H":
+                if cell == HEAD:
                     self.snake_pos.append([x, y])
 
         self.green_apples_pos = numpy.array(green_apples_pos)
@@ -80,25 +120,40 @@ class Board:
                 if (
                     not self.is_out_of_bounds(new_pos)
                     and new_pos not in self.snake_pos
-                    and self.area[new_pos[0]][new_pos[1]] == "S"
+                    and self.area[new_pos[0]][new_pos[1]] == BODY
                 ):
                     self.snake_pos.append(new_pos)
                     self.snake_size += 1
                     finished = False
                     break
 
+        self.snake_pos = collections.deque(map(tuple, self.snake_pos))
+
+        # Replays were recorded with rejection sampling for apples
+        self.legacy_respawn = True
+
         self.rngseed = new_board["seed"]
-        random.seed(self.rngseed)
-        self.rngstate = random.getstate()
+        self.rng = random.Random(self.rngseed)
 
         print("set new board!")
 
+    def set_positions(self, snake_pos, green_apples_pos, red_apples_pos):
+        self.revision += 1
+        self.lost = False
+        self.death_cause = None
+
+        self.snake_pos = collections.deque(map(tuple, snake_pos))
+        self.green_apples_pos = numpy.array(green_apples_pos).reshape(-1, 2)
+        self.red_apples_pos = numpy.array(red_apples_pos).reshape(-1, 2)
+        self.green_apples_count = len(self.green_apples_pos)
+        self.red_apples_count = len(self.red_apples_pos)
+
+        self.update_area()
+
     def reset_board(self):
-        self.area = numpy.full(
-            (self.board_size, self.board_size), "0", dtype=str
-        )
+        self.revision += 1
+        self.clear_area()
 
-        self.snake_pos = []
         self.init_snake()
 
         self.green_apples_pos = numpy.full((self.green_apples_count, 2), 0)
@@ -107,33 +162,24 @@ class Board:
         pass
 
     def init_apples(self, all=True):
-        random.setstate(self.rngstate)
-
         apple_types = [self.green_apples_pos, self.red_apples_pos]
 
         for apple_type_index, apple_type in enumerate(apple_types):
             for index, apple in enumerate(apple_type):
                 if all or (apple == [-1, -1]).all():
-                    x = self.random_int_within_width()
-                    y = self.random_int_within_width()
-
-                    while self.area[x][y] != "0":
-                        x = self.random_int_within_width()
-                        y = self.random_int_within_width()
+                    position = self.random_free_cell()
 
-                    apple_type[index] = [x, y]
-                    self.area[x][y] = APPLE_CODES[apple_type_index]
+                    if position is None:
+                        apple_type[index] = [-1, -1]
+                        continue
 
-        self.rngstate = random.getstate()
+                    apple_type[index] = position
+                    self.set_cell(position, APPLE_CODES[apple_type_index])
 
     def init_snake(self):
-        random.setstate(self.rngstate)
-
-        self.snake_pos = []
-
         # Head
-        self.snake_pos.append(
-            [self.random_int_within_width(), self.random_int_within_width()]
+        self.snake_pos = collections.deque(
+            [(self.random_int_within_width(), self.random_int_within_width())]
         )
 
         # Body
@@ -142,71 +188,159 @@ class Board:
 
             while new_pos == -1:
                 # Choose X or Y
-                dimension = random.randint(0, 1)
+                dimension = self.rng.randint(0, 1)
                 new_pos = (
                     self.snake_pos[-1][dimension]
-                    + [-1, 1][random.randrange(2)]
+                    + [-1, 1][self.rng.randrange(2)]
                 )
 
                 # Check if new position is valid
                 if new_pos >= self.board_size:
                     new_pos = -1
 
-                tile_to_be = copy.deepcopy(self.snake_pos[-1])
+                tile_to_be = list(self.snake_pos[-1])
                 tile_to_be[dimension] = new_pos
+                tile_to_be = tuple(tile_to_be)
 
                 # Check if new position isn't already taken
-                for snake_chunk in self.snake_pos:
-                    if snake_chunk == tile_to_be:
-                        new_pos = -1
-                        break
+                if tile_to_be in self.snake_pos:
+                    new_pos = -1
 
-            # Copy last pos, then modify it
-            self.snake_pos.append(copy.deepcopy(self.snake_pos[-1]))
-            self.snake_pos[-1][dimension] = new_pos
+            self.snake_pos.append(tile_to_be)
 
-        self.rngstate = random.getstate()
         self.update_area_snake()
 
     def update_area_snake(self):
         for snake_chunk in self.snake_pos:
-            if (
-                snake_chunk[0] < self.board_size
-                and snake_chunk[1] < self.board_size
-            ):
-                self.area[snake_chunk[0]][snake_chunk[1]] = "S"
+            if not self.is_out_of_bounds(snake_chunk):
+                self.set_cell(snake_chunk, BODY)
 
-        if (
-            self.snake_pos[0][0] < self.board_size
-            and self.snake_pos[0][1] < self.board_size
-        ):
-            self.area[self.snake_pos[0][0]][self.snake_pos[0][1]] = "H"
+        if not self.is_out_of_bounds(self.snake_pos[0]):
+            self.set_cell(self.snake_pos[0], HEAD)
 
     def update_area_apples(self):
         apple_types = [self.green_apples_pos, self.red_apples_pos]
 
         for apple_type, apple_code in zip(apple_types, APPLE_CODES):
             for apple in apple_type:
-                self.area[apple[0]][apple[1]] = apple_code
+                if not self.is_out_of_bounds(apple):
+                    self.set_cell(apple, apple_code)
+
+    def update_area_cells(self, old_head_pos, vacated_pos):
+        # Only the cells touched by the last move change
+        if not self.is_out_of_bounds(old_head_pos):
+            self.set_cell(old_head_pos, BODY)
+
+        for position in vacated_pos:
+            self.set_cell(position, EMPTY)
+
+        new_head_pos = self.snake_pos[0]
+        if not self.is_out_of_bounds(new_head_pos):
+            self.set_cell(new_head_pos, HEAD)
+
+    def check_area(self):
+        # Rebuilt aside, the board itself must stay untouched so that the
+        # free cell order, and with it apple respawns, do not change
+        reference = numpy.full_like(self.area, EMPTY)
+        for snake_chunk in self.snake_pos:
+            if not self.is_out_of_bounds(snake_chunk):
+                reference[snake_chunk[0], snake_chunk[1]] = BODY
+        if not self.is_out_of_bounds(self.snake_pos[0]):
+            reference[self.snake_pos[0][0], self.snake_pos[0][1]] = HEAD
+
+        apple_types = [self.green_apples_pos, self.red_apples_pos]
+        for apple_type, apple_code in zip(apple_types, APPLE_CODES):
+            for apple in apple_type:
+                if not self.is_out_of_bounds(apple):
+                    reference[apple[0], apple[1]] = apple_code
+
+        if not (reference == self.area).all():
+            raise RuntimeError(
+                "Incremental board update diverged from full rebuild"
+            )
+        if set(numpy.flatnonzero(reference == EMPTY).tolist()) != set(
+            self.free_cells
+        ):
+            raise RuntimeError("Free cell index diverged from the board")
 
     def update_area(self):
-        # Reset area
+        self.clear_area()
+        self.update_area_snake()
+        self.update_area_apples()
+
+    def clear_area(self):
         self.area = numpy.full(
-            (self.board_size, self.board_size), "0", dtype=str
+            (self.board_size, self.board_size), EMPTY, dtype=numpy.uint8
+        )
+        self.index_free_cells()
+
+    def index_free_cells(self, free_cells=None):
+        # Empty cells as flat indices, with each cell's slot in that list
+        # (or -1) so cells can be taken and released in O(1). Both are C int
+        # arrays, built and copied without a Python object per cell
+        if free_cells is None:
+            free_cells = numpy.flatnonzero(self.area == EMPTY)
+        free_cells = numpy.asarray(free_cells, dtype=numpy.intc)
+
+        free_index = numpy.full(self.area.size, -1, dtype=numpy.intc)
+        free_index[free_cells] = numpy.arange(
+            len(free_cells), dtype=numpy.intc
         )
 
-        self.update_area_snake()
-        self.update_area_apples()
+        self.free_cells = array.array("i", free_cells.tobytes())
+        self.free_index = array.array("i", free_index.tobytes())
+
+    def set_cell(self, position, code):
+        self.area[position[0]][position[1]] = code
+
+        cell = position[0] * self.board_size + position[1]
+        slot = self.free_index[cell]
+
+        if slot >= 0 and code != EMPTY:
+            last_cell = self.free_cells.pop()
+            if last_cell != cell:
+                self.free_cells[slot] = last_cell
+                self.free_index[last_cell] = slot
+            self.free_index[cell] = -1
+        elif slot < 0 and code == EMPTY:
+            self.free_index[cell] = len(self.free_cells)
+            self.free_cells.append(cell)
+
+    def random_free_cell(self):
+        if not self.free_cells:
+            return None
+
+        if self.legacy_respawn:
+            x = self.random_int_within_width()
+            y = self.random_int_within_width()
+
+            while self.area[x][y] != EMPTY:
+                x = self.random_int_within_width()
+                y = self.random_int_within_width()
+
+            return x, y
+
+        cell = self.free_cells[self.rng.randrange(len(self.free_cells))]
+        return divmod(cell, self.board_size)
 
     def random_int_within_width(self):
-        return random.randint(0, self.board_size - 1)
+        return self.rng.randint(0, self.board_size - 1)
 
     def move_snake(self, direction):
-        new_head_pos = [sum(x) for x in zip(self.snake_pos[0], direction)]
+        self.revision += 1
+        new_head_pos = (
+            self.snake_pos[0][0] + direction[0],
+            self.snake_pos[0][1] + direction[1],
+        )
 
+        # The grid doubles as the occupancy map of the snake
+        hit_body = False
         if self.is_out_of_bounds(new_head_pos):
             # print("Out of bounds!")
             self.lost = True
+            self.death_cause = "wall"
+        else:
+            hit_body = self.area[new_head_pos[0]][new_head_pos[1]] == BODY
 
         ate_green = False
         ate_red = False
@@ -230,21 +364,30 @@ class Board:
         if ate_red and len(self.snake_pos) <= 1:
             # print("Got too small!")
             self.lost = True
+            self.death_cause = "size"
+
+        old_head_pos = self.snake_pos[0]
+        vacated_pos = []
 
-        self.snake_pos.insert(0, new_head_pos)
+        self.snake_pos.appendleft(new_head_pos)
         if not ate_green:
-            self.snake_pos.pop()
+            vacated_pos.append(self.snake_pos.pop())
         if ate_red and not self.lost:
-            self.snake_pos.pop()
+            vacated_pos.append(self.snake_pos.pop())
 
-        if new_head_pos in self.snake_pos[1:]:
+        # Moving into the cell the tail just left is allowed
+        if hit_body and new_head_pos not in vacated_pos:
             # print("Hit tail!")
             self.lost = True
+            self.death_cause = "tail"
 
+        # Respawn sees the board as it was before the move
         if ate_green or ate_red:
             self.init_apples(all=False)
 
-        self.update_area()
+        self.update_area_cells(old_head_pos, vacated_pos)
+        if self.check_updates and not self.lost:
+            self.check_area()
 
         if self.lost:
             return "L"
@@ -255,14 +398,86 @@ class Board:
         else:
             return "0"
 
+    def snapshot(self):
+        return BoardSnapshot(
+            self.board_size,
+            self.snake_size,
+            self.area.tobytes(),
+            self.free_cells.tobytes(),
+            numpy.array(self.snake_pos, dtype=numpy.int16).tobytes(),
+            self.green_apples_pos.astype(numpy.int16).tobytes(),
+            self.red_apples_pos.astype(numpy.int16).tobytes(),
+            self.lost,
+            self.death_cause,
+            self.legacy_respawn,
+            self.rngseed,
+            self.rng.getstate(),
+        )
+
+    def restore(self, snapshot: BoardSnapshot):
+        self.revision = getattr(self, "revision", 0) + 1
+        self.check_updates = getattr(self, "check_updates", False)
+
+        self.board_size = snapshot.board_size
+        self.snake_size = snapshot.snake_size
+        self.lost = snapshot.lost
+        self.death_cause = snapshot.death_cause
+        self.legacy_respawn = snapshot.legacy_respawn
+
+        self.area = numpy.frombuffer(snapshot.area, dtype=numpy.uint8)
+        self.area = self.area.reshape(self.board_size, self.board_size).copy()
+
+        self.index_free_cells(
+            numpy.frombuffer(snapshot.free_cells, dtype=numpy.intc)
+        )
+
+        snake_pos = numpy.frombuffer(snapshot.snake_pos, dtype=numpy.int16)
+        self.snake_pos = collections.deque(
+            map(tuple, snake_pos.reshape(-1, 2).tolist())
+        )
+
+        self.green_apples_pos = (
+            numpy.frombuffer(snapshot.green_apples_pos, dtype=numpy.int16)
+            .reshape(-1, 2)
+            .astype(int)
+        )
+        self.red_apples_pos = (
+            numpy.frombuffer(snapshot.red_apples_pos, dtype=numpy.int16)
+            .reshape(-1, 2)
+            .astype(int)
+        )
+        self.green_apples_count = len(self.green_apples_pos)
+        self.red_apples_count = len(self.red_apples_pos)
+
+        self.rngseed = snapshot.rngseed
+        self.rng = random.Random()
+        self.rng.setstate(snapshot.rng_state)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: BoardSnapshot):
+        # The constructor would draw a new game, skip it
+        game = cls.__new__(cls)
+        game.restore(snapshot)
+        return game
+
     def is_out_of_bounds(self, position):
         for value in position:
             if value < 0 or value >= self.board_size:
                 return True
         return False
 
+    def state_hash(self):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.area.tobytes())
+        digest.update(numpy.array(self.snake_pos, dtype=numpy.int32).tobytes())
+        digest.update(bytes([self.lost]))
+        return digest.hexdigest()
+
+    def string_area(self):
+        return numpy.array(CELL_CODES)[self.area]
+
     def display_area_cli(self):
-        displayed_board = self.area.T
+        displayed_board = self.string_area().T
 
         for _ in range(len(displayed_board) + 2):
             print("W", end="")
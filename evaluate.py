@@ -0,0 +1,222 @@
+import board
+import interpreter
+import agent
+import learn2slither
+import qtable
+import numpy
+import json
+import multiprocessing
+import sys
+
+import argparse
+
+DEATH_CAUSES = ["wall", "tail", "size", "timeout"]
+
+
+class Evaluator:
+    def __init__(
+        self,
+        model,
+        vision_length=1,
+        max_epoch=10000,
+        board_options=None,
+    ):
+        self.board_options = board_options or {}
+
+        # Greedy policy on a read-only, memory-mapped table
+        self.qlearner = learn2slither.Qlearner(
+            arginterpreter=interpreter.Interpreter(vision_length),
+            argagent=agent.Agent(exploration_rate=0),
+            load_qval=model,
+            max_epoch=max_epoch,
+            no_learning=True,
+        )
+
+    def run_episode(self, seed):
+        game = board.Board(seed=seed, **self.board_options)
+        self.qlearner.board = game
+
+        lifetime = 0
+        eaten = {"G": 0, "R": 0}
+
+        while not game.lost and lifetime < self.qlearner.max_epoch:
+            type_eaten = self.qlearner.new_step()
+            if type_eaten in eaten:
+                eaten[type_eaten] += 1
+            lifetime += 1
+
+        self.qlearner.inputs = bytearray()
+
+        return {
+            "seed": seed,
+            "length": len(game.snake_pos),
+            "lifetime": lifetime,
+            "green_apples": eaten["G"],
+            "red_apples": eaten["R"],
+            "death": game.death_cause or "timeout",
+        }
+
+
+evaluator = None
+
+
+def init_worker(*options):
+    global evaluator
+    evaluator = Evaluator(*options)
+
+
+def run_worker_episode(seed):
+    return evaluator.run_episode(seed)
+
+
+def check_model(model, vision_length):
+    # Checked once here, a worker failing to load it would be restarted
+    # by the pool forever
+    try:
+        _, metadata = qtable.load_qvalues(model, mmap=True)
+    except FileNotFoundError:
+        sys.exit(f"Input file {model} does not exist.")
+
+    trained_length = metadata.get("vision_length", vision_length)
+    if trained_length != vision_length:
+        sys.exit(
+            f"Input file {model} was trained with a vision length of "
+            + f"{trained_length}."
+        )
+
+
+def evaluate(
+    model,
+    episodes=100,
+    seed=1,
+    processes=1,
+    vision_length=1,
+    max_epoch=10000,
+    board_options=None,
+):
+    check_model(model, vision_length)
+
+    seeds = range(seed, seed + episodes)
+    options = (model, vision_length, max_epoch, board_options)
+
+    if processes > 1:
+        with multiprocessing.Pool(
+            processes, initializer=init_worker, initargs=options
+        ) as pool:
+            return pool.map(
+                run_worker_episode,
+                seeds,
+                chunksize=max(episodes // (processes * 4), 1),
+            )
+
+    init_worker(*options)
+    return [run_worker_episode(episode_seed) for episode_seed in seeds]
+
+
+def describe(values):
+    values = numpy.array(values)
+    return {
+        "mean": float(values.mean()),
+        "median": float(numpy.median(values)),
+        "p95": float(numpy.percentile(values, 95)),
+        "min": int(values.min()),
+        "max": int(values.max()),
+    }
+
+
+def summarize(results):
+    summary = {"episodes": len(results)}
+
+    for metric in ["length", "lifetime", "green_apples", "red_apples"]:
+        summary[metric] = describe([result[metric] for result in results])
+
+    summary["deaths"] = {
+        cause: sum(result["death"] == cause for result in results)
+        for cause in DEATH_CAUSES
+    }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Learn2slither evaluation",
+        description="Play seeded episodes greedily with a saved model "
+        + "and report statistics as JSON",
+    )
+    parser.add_argument("model", type=str, help="The Q values file")
+    parser.add_argument(
+        "-e",
+        "--episodes",
+        type=int,
+        default=100,
+        help="The number of episodes to play",
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        default=1,
+        help="Seed of the first episode, the others follow it",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=1,
+        help="Play episodes in multiple worker processes",
+    )
+    parser.add_argument(
+        "-m",
+        "--max-epoch",
+        type=int,
+        default=10000,
+        help="Stop episodes that last longer than this many moves",
+    )
+    parser.add_argument(
+        "-l",
+        "--vision-length",
+        type=int,
+        default=1,
+        help="The vision length the model was trained with",
+    )
+    parser.add_argument(
+        "-b",
+        "--board-size",
+        type=int,
+        default=10,
+        help="The width and height of the board",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=False,
+        help="The file to write the JSON report to instead of stdout",
+    )
+    parser.add_argument(
+        "--episodes-detail",
+        action="store_true",
+        help="Include every episode in the report",
+    )
+
+    args = parser.parse_args()
+
+    results = evaluate(
+        args.model,
+        episodes=args.episodes,
+        seed=args.seed,
+        processes=args.processes,
+        vision_length=args.vision_length,
+        max_epoch=args.max_epoch,
+        board_options={"board_size": args.board_size},
+    )
+
+    report = summarize(results)
+    if args.episodes_detail:
+        report["results"] = results
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(report, fd, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
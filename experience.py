@@ -0,0 +1,52 @@
+import numpy
+
+
+class ExperienceBuffer:
+    __slots__ = (
+        "capacity",
+        "states",
+        "new_states",
+        "actions",
+        "rewards",
+        "position",
+        "size",
+        "rng",
+    )
+
+    def __init__(self, capacity=65536, seed=None):
+        self.capacity = capacity
+
+        # Lost games keep their negative serial number as the new state,
+        # the same way Agent tells them apart
+        self.states = numpy.zeros(capacity, dtype=numpy.int64)
+        self.new_states = numpy.zeros(capacity, dtype=numpy.int64)
+        self.actions = numpy.zeros(capacity, dtype=numpy.uint8)
+        self.rewards = numpy.zeros(capacity)
+
+        self.position = 0
+        self.size = 0
+        self.rng = numpy.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, new_state, action, reward):
+        position = self.position
+        self.states[position] = state
+        self.new_states[position] = new_state
+        self.actions[position] = action
+        self.rewards[position] = reward
+
+        # Oldest transitions are overwritten once full
+        self.position = (position + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def sample(self, count):
+        indices = self.rng.integers(0, self.size, count)
+        return (
+            self.states[indices],
+            self.new_states[indices],
+            self.actions[indices],
+            self.rewards[indices],
+        )
@@ -1,13 +1,15 @@
 import tkinter as tk
 from tkinter import filedialog
-import json
-import numpy
+import itertools
 import argparse
 import board
+import numpy
 import time
 import learn2slither
+import qtable
+import replay
 
-TILES = ["0", "H", "S", "G", "R"]
+# Indexed by board cell code
 COLORS = ["white", "skyblue", "blue", "green", "red"]
 
 DIRECTIONS_FULL_NAMES = ["Up", "Down", "Left", "Right"]
@@ -19,6 +21,8 @@ BOARD_HEIGHT = 300
 FPS_OPTIONS = ["Unlimited", "120", "60", "30", "15", "5", "1"]
 SPEED_LIMITS = [0, 1 / 120, 1 / 60, 1 / 30, 1 / 15, 1 / 5, 1]
 
+RENDER_FPS_OPTIONS = ["60", "30", "15", "5", "1"]
+
 
 def get_direction_vector(name):
     return DIRECTIONS[DIRECTIONS_NAMES.index(name)]
@@ -29,6 +33,8 @@ class GraphicalInterface:
         self,
         model=learn2slither.Qlearner(),
         speedlimit=2,
+        render_fps=1,
+        steps_per_tick=100,
         stopped=True,
         no_learning=False,
         verbose=False,
@@ -36,6 +42,13 @@ class GraphicalInterface:
         self.model = model
 
         self.speedlimit = speedlimit
+        self.render_fps = render_fps
+        self.last_render = 0
+
+        # Moves are played from Tk's event loop, in ticks
+        self.steps_per_tick = steps_per_tick
+        self.next_tick = 0
+        self.tick_id = None
 
         self.stopped = stopped
         self.model.no_learning = no_learning
@@ -52,6 +65,12 @@ class GraphicalInterface:
         )
         self.board_frame.grid(padx=(10, 10))
 
+        # Canvas items reused between frames
+        self.tiles = []
+        self.drawn_area = None
+        self.connectors = {}
+        self.spare_connectors = []
+
         if stopped:
             self.pausebutton = tk.Button(
                 self.root, text="Resume", command=self.start
@@ -149,6 +168,7 @@ class GraphicalInterface:
         )
         button.grid(column=1, row=4, pady=(10, 0))
 
+        self.bindings = []
         if stopped:
             self.controls_frame.grid(pady=(0, 10))
             self.bind_directions()
@@ -156,14 +176,41 @@ class GraphicalInterface:
         # Replay controls
         self.replay_frame = tk.Frame(self.root)
 
-        self.inputs = []
+        self.player = None
         self.replay_mode = False
         button = tk.Button(
             self.replay_frame,
             text="Exit replay mode",
             command=self.exit_replay,
         )
-        button.grid(sticky="w")
+        button.grid(column=0, row=0, columnspan=3, sticky="w")
+
+        button = tk.Button(
+            self.replay_frame, text="Start", command=lambda: self.seek(0)
+        )
+        button.grid(column=0, row=1)
+        button = tk.Button(
+            self.replay_frame,
+            text="Back",
+            command=lambda: self.seek(self.player.position - 1),
+        )
+        button.grid(column=1, row=1)
+        button = tk.Button(
+            self.replay_frame,
+            text="Forward",
+            command=lambda: self.seek(self.player.position + 1),
+        )
+        button.grid(column=2, row=1)
+
+        self.replay_position = tk.IntVar(self.replay_frame, 0)
+        self.replay_scale = tk.Scale(
+            self.replay_frame,
+            variable=self.replay_position,
+            orient="horizontal",
+            showvalue=True,
+            command=lambda position: self.seek(int(position)),
+        )
+        self.replay_scale.grid(column=0, row=2, columnspan=3, sticky="we")
 
     def init_options_menu(self):
         self.stop()
@@ -175,7 +222,7 @@ class GraphicalInterface:
 
         # Speed
         text = tk.StringVar(options_grid)
-        text.set("Maximum FPS")
+        text.set("Moves per second")
         label = tk.Label(options_grid, textvariable=text)
         label.grid(column=0, row=0)
 
@@ -190,11 +237,28 @@ class GraphicalInterface:
         )
         speeds.grid(column=1, row=0)
 
+        # Rendering, independent from the speed of the game
+        text = tk.StringVar(options_grid)
+        text.set("Display FPS")
+        label = tk.Label(options_grid, textvariable=text)
+        label.grid(column=0, row=1)
+
+        self.current_render_option = tk.StringVar(
+            options_grid, RENDER_FPS_OPTIONS[self.render_fps]
+        )
+        render_speeds = tk.OptionMenu(
+            options_grid,
+            self.current_render_option,
+            *RENDER_FPS_OPTIONS,
+            command=self.render_option_changed,
+        )
+        render_speeds.grid(column=1, row=1)
+
         # Learning rate
         text = tk.StringVar(options_grid)
         text.set("Learning rate")
         label = tk.Label(options_grid, textvariable=text)
-        label.grid(column=0, row=1)
+        label.grid(column=0, row=2)
 
         scale = tk.Scale(
             options_grid,
@@ -205,13 +269,13 @@ class GraphicalInterface:
             command=self.learning_rate_changed,
         )
         scale.set(self.model.agent.learning_rate)
-        scale.grid(column=1, row=1)
+        scale.grid(column=1, row=2)
 
         # Exploration rate
         text = tk.StringVar(options_grid)
         text.set("Exploration rate")
         label = tk.Label(options_grid, textvariable=text)
-        label.grid(column=0, row=2)
+        label.grid(column=0, row=3)
 
         scale = tk.Scale(
             options_grid,
@@ -222,13 +286,13 @@ class GraphicalInterface:
             command=self.exploration_rate_changed,
         )
         scale.set(self.model.agent.exploration_rate)
-        scale.grid(column=1, row=2)
+        scale.grid(column=1, row=3)
 
         # Decay rate
         text = tk.StringVar(options_grid)
         text.set("Reward decay rate")
         label = tk.Label(options_grid, textvariable=text)
-        label.grid(column=0, row=3)
+        label.grid(column=0, row=4)
 
         scale = tk.Scale(
             options_grid,
@@ -239,7 +303,7 @@ class GraphicalInterface:
             command=self.decay_changed,
         )
         scale.set(self.model.agent.decay)
-        scale.grid(column=1, row=3)
+        scale.grid(column=1, row=4)
 
         # Close button
         button = tk.Button(
@@ -263,15 +327,15 @@ class GraphicalInterface:
         self.bindings.append(bind)
 
     def unbind_directions(self):
-        for index, direction_full in enumerate(DIRECTIONS_NAMES):
-            self.root.unbind(f"<{direction_full}>", self.bindings[index])
+        # Nothing is bound when the GUI starts running
+        for direction_full, bind in zip(DIRECTIONS_NAMES, self.bindings):
+            self.root.unbind(f"<{direction_full}>", bind)
+        self.bindings = []
 
     def update_displayed_qvalues(self):
         self.snake_size.set(len(self.model.board.snake_pos))
 
-        state, order, _ = self.model.interpreter.calculate_state(
-            self.model.board
-        )
+        state, order, _ = self.model.current_state()
 
         for index, qvalue in enumerate(self.q_values):
             if state >= 0:
@@ -304,10 +368,13 @@ class GraphicalInterface:
         )
 
         try:
-            self.model.agent.states = numpy.loadtxt(q_values_file)
+            states, metadata = qtable.load_qvalues(q_values_file)
         except FileNotFoundError:
             return
 
+        self.model.agent.states = states
+        self.model.episodes = metadata.get("episodes", 0)
+
     def open_replay_file(self):
         replay_filename = filedialog.askopenfilename(
             title="Open a replay file",
@@ -316,26 +383,40 @@ class GraphicalInterface:
         )
 
         try:
-            with open(replay_filename, "r") as fd:
-                replay_data = json.load(fd)
+            replay_board, actions, _ = replay.load_replay(replay_filename)
         except FileNotFoundError:
             return
 
-        self.model.board.set_board(replay_data)
-        self.model.board.lost = False
-
-        self.inputs = replay_data["inputs"]
+        # Moves can be played in any order from keyframes of the replay
+        self.player = replay.ReplayPlayer(replay_board, actions)
+        self.model.board = self.player.board
         self.replay_mode = True
 
+        self.replay_scale.config(to=self.player.length)
+        self.replay_position.set(0)
+
         self.draw_board()
         self.replay_frame.grid()
 
+    def seek(self, position):
+        if self.player is None:
+            return
+
+        self.model.board = self.player.seek(position)
+        self.replay_mode = True
+        self.render()
+
     def close_options_menu(self):
         self.menu_window.destroy()
 
     def speed_option_changed(self, *args):
         self.speedlimit = FPS_OPTIONS.index(self.current_speed_option.get())
 
+    def render_option_changed(self, *args):
+        self.render_fps = RENDER_FPS_OPTIONS.index(
+            self.current_render_option.get()
+        )
+
     def learning_rate_changed(self, *args):
         self.model.agent.learning_rate = float(args[0])
 
@@ -347,25 +428,36 @@ class GraphicalInterface:
 
     def exit_replay(self):
         self.replay_mode = False
+        self.player = None
         self.stop()
         self.replay_frame.grid_remove()
 
     def step(self):
         if not self.model.board.lost:
-            if self.replay_mode and len(self.inputs) > 0:
-                self.move_snake(self.inputs.pop(0))
-            elif self.replay_mode:
-                self.replay_mode = False
-            else:
-                self.model.new_step()
+            self.advance()
         else:
             new_board = board.Board()
             self.model.board = new_board
 
+        self.render()
+
+    def advance(self):
+        # One move of the replay or of the agent, drawn later by render
+        if self.replay_mode and self.player.position < self.player.length:
+            self.model.board = self.player.forward()
+        elif self.replay_mode:
+            self.replay_mode = False
+        else:
+            self.model.new_step()
+
+    def render(self):
+        self.last_render = time.perf_counter()
+
         self.draw_board()
         self.update_displayed_qvalues()
+        if self.replay_mode:
+            self.replay_position.set(self.player.position)
         self.root.update_idletasks()
-        self.root.update()
 
     def move_snake(self, direction):
         self.model.board.move_snake(direction)
@@ -377,75 +469,86 @@ class GraphicalInterface:
         self.draw_board()
 
     def draw_board(self):
-        if self.model.board.lost:
+        game = self.model.board
+        if game.lost:
             return
 
-        tile_size = BOARD_HEIGHT / self.model.board.board_size
+        if self.drawn_area is None or self.drawn_area.shape != game.area.shape:
+            self.create_tiles(game.board_size)
+
+        # Tiles are drawn once, after that only changed cells are recolored
+        canvas = self.board_frame
+        for x, y in numpy.argwhere(game.area != self.drawn_area).tolist():
+            canvas.itemconfig(self.tiles[x][y], fill=COLORS[game.area[x, y]])
+        self.drawn_area = game.area.copy()
+
+        self.draw_connectors(game)
+
+    def create_tiles(self, board_size):
+        tile_size = BOARD_HEIGHT / board_size
 
         canvas = self.board_frame
         canvas.delete("all")
 
-        board_area = self.model.board.area.T
-
-        # Connect the snake
-        if self.model.board.lost is False:
-            for index, _ in enumerate(self.model.board.snake_pos):
-                if len(self.model.board.snake_pos) > index + 1:
-                    canvas.create_rectangle(
-                        tile_size
-                        * (
-                            (
-                                self.model.board.snake_pos[index][0]
-                                + self.model.board.snake_pos[index + 1][0]
-                            )
-                            / 2
-                        ),
-                        tile_size
-                        * (
-                            (
-                                self.model.board.snake_pos[index][1]
-                                + self.model.board.snake_pos[index + 1][1]
-                            )
-                            / 2
-                        ),
-                        tile_size
-                        * (
-                            (
-                                (
-                                    self.model.board.snake_pos[index][0]
-                                    + self.model.board.snake_pos[index + 1][0]
-                                )
-                                / 2
-                            )
-                            + 1
-                        ),
-                        tile_size
-                        * (
-                            (
-                                (
-                                    self.model.board.snake_pos[index][1]
-                                    + self.model.board.snake_pos[index + 1][1]
-                                )
-                                / 2
-                            )
-                            + 1
-                        ),
-                        outline="",
-                        fill="blue",
-                    )
+        self.tiles = [
+            [
+                canvas.create_oval(
+                    tile_size * x,
+                    tile_size * y,
+                    tile_size * (x + 1),
+                    tile_size * (y + 1),
+                    outline="",
+                    fill=COLORS[board.EMPTY],
+                )
+                for y in range(board_size)
+            ]
+            for x in range(board_size)
+        ]
+        self.drawn_area = numpy.full(
+            (board_size, board_size), board.EMPTY, dtype=numpy.uint8
+        )
 
-        # Draw the elements
-        for column_index, column in enumerate(board_area):
-            for index, tile in enumerate(column):
-                if self.model.board.lost is False:
-                    canvas.create_oval(
-                        tile_size * (index + 1),
-                        tile_size * (column_index + 1),
-                        tile_size * index,
-                        tile_size * column_index,
-                        outline="",
-                        fill=COLORS[TILES.index(tile)],
-                    )
+        self.connectors = {}
+        self.spare_connectors = []
+
+    def draw_connectors(self, game):
+        # Connectors are keyed by the sum of the two cells they join, so a
+        # move only hides the one at the tail and shows one at the head
+        snake_pos = game.snake_pos
+        links = {
+            (chunk[0] + next_chunk[0], chunk[1] + next_chunk[1])
+            for chunk, next_chunk in zip(
+                snake_pos, itertools.islice(snake_pos, 1, None)
+            )
+        }
+
+        canvas = self.board_frame
+        for link in self.connectors.keys() - links:
+            item = self.connectors.pop(link)
+            canvas.itemconfig(item, state="hidden")
+            self.spare_connectors.append(item)
+
+        tile_size = BOARD_HEIGHT / game.board_size
+        for link in links - self.connectors.keys():
+            if self.spare_connectors:
+                item = self.spare_connectors.pop()
+                canvas.itemconfig(item, state="normal")
+            else:  # Below the tiles, like the snake drawn under its body
+                item = canvas.create_rectangle(
+                    0, 0, 0, 0, outline="", fill=COLORS[board.BODY]
+                )
+                canvas.tag_lower(item)
+
+            middle_x = link[0] / 2
+            middle_y = link[1] / 2
+            canvas.coords(
+                item,
+                tile_size * middle_x,
+                tile_size * middle_y,
+                tile_size * (middle_x + 1),
+                tile_size * (middle_y + 1),
+            )
+            self.connectors[link] = item
 
     def stop_learning(self):
         self.model.no_learning = True
@@ -461,6 +564,13 @@ class GraphicalInterface:
 
     def stop(self):
         self.stopped = True
+        if self.tick_id is not None:
+            self.root.after_cancel(self.tick_id)
+            self.tick_id = None
+
+        # Frames are capped, show the moves played since the last one
+        self.render()
+
         self.pausebutton.config(text="Resume", command=self.start)
         self.controls_frame.grid()
         self.bind_directions()
@@ -472,42 +582,47 @@ class GraphicalInterface:
             self.controls_frame.grid_remove()
             self.unbind_directions()
 
-            self.start_loop(resume=True)
-
-    def start_loop(self, resume=False):
-        prevtime = time.time()
-
-        while self.stopped is False:
-            max_time = SPEED_LIMITS[self.speedlimit]
-
-            while self.model.board.lost is False:
-                if self.replay_mode and len(self.inputs) > 0:
-                    self.move_snake(self.inputs.pop(0))
-                elif self.replay_mode:
-                    self.replay_mode = False
-                else:
-                    self.model.new_step()
-                self.draw_board()
-                self.update_displayed_qvalues()
-                self.root.update_idletasks()
-                self.root.update()
-
-                if self.speedlimit:  # Limit FPS
-                    to_sleep = max_time - (time.time() - prevtime)
-                    if to_sleep > 0:
-                        time.sleep(to_sleep)
-                    prevtime = time.time()
+            self.next_tick = time.perf_counter()
+            self.tick()
+
+    def tick(self):
+        # Limited speeds play one move per tick, otherwise a whole batch
+        steps = 1 if self.speedlimit else self.steps_per_tick
+        for _ in range(steps):
+            if self.model.board.lost:
+                self.end_episode()
                 if self.stopped:
-                    break
+                    return
+            else:
+                self.advance()
 
-            if self.replay_mode:
-                self.replay_mode = False
-                self.stop()
+        # The game runs at its own speed, only the latest state is drawn
+        # once per frame
+        frame_time = 1 / int(RENDER_FPS_OPTIONS[self.render_fps])
+        if time.perf_counter() - self.last_render >= frame_time:
+            self.render()
 
-            if self.stopped is False and not resume:
-                new_board = board.Board()
-                self.model.board = new_board
-            resume = False
+        now = time.perf_counter()
+        self.next_tick = max(
+            self.next_tick + SPEED_LIMITS[self.speedlimit], now
+        )
+        self.tick_id = self.root.after(
+            int((self.next_tick - now) * 1000), self.tick
+        )
+
+    def end_episode(self):
+        self.render()
+
+        if self.replay_mode:
+            self.replay_mode = False
+            self.stop()
+        else:
+            self.model.board = board.Board()
+
+    def start_loop(self):
+        if not self.stopped:
+            self.stopped = True
+            self.start()
 
         # Start the GUI event loop
         self.root.mainloop()
@@ -531,6 +646,13 @@ if __name__ == "__main__":
         action="store_true",
         help="Stops the Q values from updating as it happens",
     )
+    parser.add_argument(
+        "--steps-per-tick",
+        type=int,
+        default=100,
+        help="The number of moves played between two GUI updates when "
+        + "the speed is unlimited",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -542,7 +664,10 @@ if __name__ == "__main__":
     model = learn2slither.Qlearner(load_qval=args.input)
 
     gui = GraphicalInterface(
-        model, no_learning=args.no_learning, verbose=args.verbose
+        model,
+        steps_per_tick=args.steps_per_tick,
+        no_learning=args.no_learning,
+        verbose=args.verbose,
     )
     gui.draw_board()
     gui.start_loop()
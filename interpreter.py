@@ -1,11 +1,17 @@
 import board
+import itertools
 import math
 
+from board import CELL_CODES, EMPTY
+
 ACTIONS = ["U", "D", "L", "R"]
 DIRECTIONS = [[0, -1], [0, 1], [-1, 0], [1, 0]]
 
 VALUES = {"0": 0, "G": 1, "R": 2, "S": 3, "g": 4}
 
+# Vision value of each board cell code, the head never shows up in a ray
+CELL_VALUES = [VALUES["0"], VALUES["S"], VALUES["S"], VALUES["G"], VALUES["R"]]
+
 REWARDS = {"0": -5, "G": 1000, "R": -100, "L": -1000, "g": 200}
 
 
@@ -20,69 +26,99 @@ class Interpreter:
     def __init__(self, vision_length=1):
         self.vision_length = vision_length
 
+        # There are only len(VALUES) ** 4 possible visions, so rank them
+        # all once here instead of on every step
+        self.state_table = [
+            (self.rank_types(types), self.order_actions(types))
+            for types in itertools.product(
+                range(len(VALUES)), repeat=len(DIRECTIONS)
+            )
+        ]
+
     def calculate_vision(self, board: board.Board, verbose):
-        head_pos = board.snake_pos[0]
-        vision = []
+        if verbose:
+            self.print_vision(board)
 
-        for index, direction in enumerate(DIRECTIONS):
-            vision.append([])
-            newest_pos = [sum(x) for x in zip(head_pos, direction)]
-            while not board.is_out_of_bounds(newest_pos):
-                vision[index].append(board.area[newest_pos[0]][newest_pos[1]])
-                newest_pos = [sum(x) for x in zip(newest_pos, direction)]
+        types = []
 
-        if verbose:
-            to_print = ""
+        for direction in DIRECTIONS:
+            ray = self.look(board, direction, self.vision_length)
 
-            left_align = len(vision[2]) + 2
+            for tile in ray.tolist():
+                if tile != EMPTY:
+                    value = CELL_VALUES[tile]
+                    break
+            else:
+                if len(ray) < self.vision_length:
+                    value = VALUES["S"]
+                elif self.green_in_direction(board, direction):
+                    value = VALUES["g"]
+                else:
+                    value = VALUES["0"]
 
-            vision[0].reverse()
-            vision[2].reverse()
+            types.append(value)
 
-            to_print += f"{'W': >{left_align}}\n"
-            for tile in vision[0]:
-                to_print += f"{tile: >{left_align}}\n"
-            to_print += "W"
-            for tile in vision[2]:
-                to_print += tile
-            to_print += "H"
-            for tile in vision[3]:
-                to_print += tile
-            to_print += "W\n"
-            for tile in vision[1]:
-                to_print += f"{tile: >{left_align}}\n"
-            to_print += f"{'W': >{left_align}}\n"
+        return types
 
-            print(to_print)
+    def look(self, board: board.Board, direction, length=None):
+        # Tiles seen from the head, nearest first, up to length or the wall
+        x, y = board.snake_pos[0]
+        if length is None:
+            length = board.board_size
+
+        if direction[0] == 0:
+            line, position, step = board.area[x], y, direction[1]
+        else:
+            line, position, step = board.area[:, y], x, direction[0]
+
+        if step > 0:
+            start = position + 1
+            end = start + length
+            return line[start:end]
+        start = max(position - length, 0)
+        return line[start:position][::-1]
+
+    def green_in_direction(self, board: board.Board, direction):
+        x, y = board.snake_pos[0]
+
+        for apple_x, apple_y in board.green_apples_pos.tolist():
+            offset_x = apple_x - x
+            offset_y = apple_y - y
+            if (
+                offset_x * direction[1] == offset_y * direction[0]
+                and offset_x * direction[0] + offset_y * direction[1] > 0
+            ):
+                return True
 
-            vision[0].reverse()
-            vision[2].reverse()
+        return False
 
-        types = []
+    def print_vision(self, board: board.Board):
+        printed = [
+            [CELL_CODES[tile] for tile in self.look(board, direction)]
+            for direction in DIRECTIONS
+        ]
+        to_print = ""
 
-        for index, viewed_direction in enumerate(vision):
-            current_distance = 0
-            while (
-                current_distance < len(viewed_direction)
-                and current_distance < self.vision_length
-                and viewed_direction[current_distance] == "0"
-            ):
-                current_distance += 1
+        left_align = len(printed[2]) + 2
 
-            if not current_distance < self.vision_length:
-                value = VALUES["0"]
-                if "G" in viewed_direction:
-                    value = VALUES["g"]
-                current_distance -= 1
-            elif not current_distance < len(viewed_direction):
-                value = VALUES["S"]
-                current_distance -= 1
-            else:
-                value = VALUES[viewed_direction[current_distance]]
+        printed[0].reverse()
+        printed[2].reverse()
 
-            types.append(value)
+        to_print += f"{'W': >{left_align}}\n"
+        for tile in printed[0]:
+            to_print += f"{tile: >{left_align}}\n"
+        to_print += "W"
+        for tile in printed[2]:
+            to_print += tile
+        to_print += "H"
+        for tile in printed[3]:
+            to_print += tile
+        to_print += "W\n"
+        for tile in printed[1]:
+            to_print += f"{tile: >{left_align}}\n"
+        to_print += f"{'W': >{left_align}}\n"
 
-        return types
+        print(to_print)
 
     def calculate_state(self, board: board.Board, verbose=False):
         if board.lost:
@@ -90,11 +126,15 @@ class Interpreter:
 
         types = self.calculate_vision(board, verbose)
 
-        actions = [
-            x
-            for (y, x) in sorted(zip(types, ACTIONS), key=lambda pair: pair[0])
-        ]
+        table_index = 0
+        for value in types:
+            table_index = table_index * len(VALUES) + value
 
+        total_state_value, actions = self.state_table[table_index]
+
+        return total_state_value, actions, REWARDS["L"]
+
+    def rank_types(self, types):
         sorted_values = sorted(types)
         total_state_value = 0
         inc = 0
@@ -110,20 +150,18 @@ class Interpreter:
             n -= value
             inc += value
 
-        return total_state_value, actions, REWARDS["L"]
+        return total_state_value
+
+    def order_actions(self, types):
+        return tuple(
+            x
+            for (y, x) in sorted(zip(types, ACTIONS), key=lambda pair: pair[0])
+        )
 
     def calculate_reward(self, direction, type_eaten, board: board.Board):
         reward = REWARDS[type_eaten]
 
-        head_pos = board.snake_pos[0]
-        position = [sum(x) for x in zip(head_pos, direction)]
-        vision = []
-
-        while not board.is_out_of_bounds(position):
-            vision.append(board.area[position[0]][position[1]])
-            position = [sum(x) for x in zip(position, direction)]
-
-        if "G" in vision and not board.lost:
+        if not board.lost and self.green_in_direction(board, direction):
             reward += REWARDS["g"]
 
         return reward
@@ -1,11 +1,19 @@
 import board
 import interpreter
 import agent
+import experience
+import profiler
+import qtable
+import recorder
+import replay
 import numpy
 import math
-import json
+import random
+import time
 
 import argparse
+import cProfile
+import multiprocessing
 
 ACTIONS = ["U", "D", "L", "R"]
 ACTIONS_NAMES = ["UP", "DOWN", "LEFT", "RIGHT"]
@@ -13,6 +21,10 @@ DIRECTIONS = [[0, -1], [0, 1], [-1, 0], [1, 0]]
 VALUES = {"0": 0, "G": 1, "R": 2, "S": 3, "g": 4}
 
 
+def skip_lap(phase):
+    pass
+
+
 class Qlearner:
 
     def __init__(
@@ -27,6 +39,11 @@ class Qlearner:
         save_replay=False,
         no_learning=False,
         verbose=False,
+        episode_recorder=None,
+        replay_stream=None,
+        profiler=None,
+        experience_buffer=None,
+        experience_batch=32,
     ):
         self.board = board.Board() if argboard is None else argboard
         self.interpreter = interpreter.Interpreter() if arginterpreter is None\
@@ -35,13 +52,39 @@ class Qlearner:
 
         self.no_learning = no_learning
         self.verbose = verbose
+        self.episode_recorder = episode_recorder
+        self.episodes = 0
+
+        # Moves are written to the stream as they are played, one replay
+        # per episode
+        self.replay_stream = replay_stream
+        self.replay_writer = None
+
+        self.experience_buffer = experience_buffer
+        self.experience_batch = experience_batch
+
+        self.profiler = profiler
+        self.lap = skip_lap if profiler is None else profiler.lap
 
         if load_qval:
             try:
-                states = numpy.loadtxt(load_qval)
+                # Read-only models are mapped, not copied, into memory
+                states, metadata = qtable.load_qvalues(
+                    load_qval, mmap=no_learning
+                )
             except FileNotFoundError:
                 print(f"Input file {load_qval} does not exist.")
                 exit()
+            vision_length = metadata.get(
+                "vision_length", self.interpreter.vision_length
+            )
+            if vision_length != self.interpreter.vision_length:
+                print(
+                    f"Input file {load_qval} was trained with a vision",
+                    f"length of {vision_length}.",
+                )
+                exit()
+            self.episodes = metadata.get("episodes", 0)
             if self.verbose:
                 print(f"Loaded model from {load_qval}.")
         else:  # Lowest possible number of states without repeats
@@ -63,27 +106,80 @@ class Qlearner:
 
         self.save_qval = save_qval
         self.save_replay = save_replay
-        self.starting_state = self.board.area.tolist()
-        self.inputs = []
+        self.replay_header = replay.board_header(self.board)
+        self.inputs = bytearray()
+
+        self.state = None
+        self.state_board = None
+        self.state_revision = None
+
+    def current_state(self, verbose=False):
+        # The state after the previous move is reused unless the board has
+        # been replaced or changed since
+        if (
+            verbose
+            or self.state_board is not self.board
+            or self.state_revision != self.board.revision
+        ):
+            self.remember_state(
+                self.interpreter.calculate_state(self.board, verbose)
+            )
+        return self.state
+
+    def remember_state(self, state):
+        self.state = state
+        self.state_board = self.board
+        self.state_revision = self.board.revision
 
     def new_step(self):
-        state = self.interpreter.calculate_state(self.board, self.verbose)
+        # Each lap charges the time since the previous one to a phase, it
+        # does nothing unless profiling
+        lap = self.lap
+        lap(None)
+
+        state = self.current_state(self.verbose)
+        lap("state")
 
         action, direction = self.agent.choose_direction(state)
-        self.inputs.append(direction)
+        self.inputs.append(DIRECTIONS.index(direction))
+        if self.replay_writer is not None:
+            self.replay_writer.add(self.inputs[-1])
+        lap("choose")
 
         if self.verbose:
             print(f"{ACTIONS_NAMES[DIRECTIONS.index(direction)]}\n")
+            lap(None)
 
         type_eaten = self.board.move_snake(direction)
+        lap("move")
+
+        new_state = self.interpreter.calculate_state(self.board)
+        self.remember_state(new_state)
+        lap("state")
 
         if not self.no_learning:
-            new_state = self.interpreter.calculate_state(self.board)
             reward = self.interpreter.calculate_reward(
                 direction, type_eaten, self.board
             )
+            lap("reward")
 
             self.agent.update_states(state, new_state, action, reward)
+            if self.experience_buffer is not None:
+                self.replay_experience(state, new_state, action, reward)
+            lap("update")
+
+        if self.profiler is not None:
+            self.profiler.count_step(type_eaten)
+
+        return type_eaten
+
+    def replay_experience(self, state, new_state, action, reward):
+        # Past transitions are learned from again, in batches
+        self.experience_buffer.add(state[0], new_state[0], action, reward)
+        if len(self.experience_buffer) >= self.experience_batch:
+            self.agent.update_states_batch(
+                *self.experience_buffer.sample(self.experience_batch)
+            )
 
     def loop(self):
         ep_count = 0
@@ -91,14 +187,44 @@ class Qlearner:
 
         longest_size = 0
         longest_life = 0
-        best = {"score": 0, "lifetime": 0, "starting_state": 0, "inputs": []}
+        # Without any episode, the replay is the untouched starting board
+        best = {
+            "score": 0,
+            "lifetime": 0,
+            "header": self.replay_header,
+            "inputs": b"",
+            "hash": self.board.state_hash(),
+        }
 
         while ep_count < self.max_sessions:
+            if self.replay_stream is not None:
+                self.replay_writer = replay.ReplayWriter(
+                    self.replay_stream, self.replay_header
+                )
+
             while self.board.lost is False and epoch < self.max_epoch:
                 self.new_step()
                 epoch += 1
 
             ep_count += 1
+            if not self.no_learning:
+                self.episodes += 1
+
+            if self.profiler is not None:
+                self.profiler.end_episode(self.board)
+
+            trailer = {
+                "score": len(self.board.snake_pos),
+                "lifetime": epoch,
+                "hash": self.board.state_hash(),
+            }
+            if self.replay_writer is not None:
+                self.replay_writer.close(trailer)
+                self.replay_writer = None
+            if self.episode_recorder is not None:
+                self.episode_recorder.record(
+                    self.replay_header, self.inputs, trailer
+                )
 
             if epoch > longest_life:
                 if self.verbose:
@@ -113,18 +239,21 @@ class Qlearner:
 
                 best["score"] = longest_size
                 best["lifetime"] = epoch
-                best["starting_state"] = self.starting_state
+                best["header"] = self.replay_header
                 best["inputs"] = self.inputs
-                best["seed"] = self.board.rngseed
+                best["hash"] = trailer["hash"]
 
             self.board = board.Board()
-            self.starting_state = self.board.area.tolist()
-            self.inputs = []
+            self.replay_header = replay.board_header(self.board)
+            self.inputs = bytearray()
 
             epoch = 0
             if self.verbose:
                 print(f"Episode {ep_count}")
 
+        if self.profiler is not None:
+            self.profiler.emit()
+
         print(
             f"Training finished for {self.max_sessions} sessions.",
             f"Longest size: {longest_size}",
@@ -143,12 +272,29 @@ class Qlearner:
         return best
 
     def save_qvalues_file(self):
-        with open(self.save_qval, "w") as fd:
-            numpy.savetxt(fd, self.agent.states)
+        qtable.save_qvalues(
+            self.save_qval,
+            self.agent.states,
+            {
+                "vision_length": self.interpreter.vision_length,
+                "actions": ACTIONS,
+                "values": VALUES,
+                "rewards": interpreter.REWARDS,
+                "episodes": self.episodes,
+            },
+        )
 
-    def save_replay_file(self, replay):
-        with open(self.save_replay, "w") as fd:
-            json.dump(replay, fd)
+    def save_replay_file(self, best):
+        replay.write_replay(
+            self.save_replay,
+            best["header"],
+            best["inputs"],
+            {
+                "score": best["score"],
+                "lifetime": best["lifetime"],
+                "hash": best["hash"],
+            },
+        )
 
 
 def play_wrapper(qlearner: Qlearner):
@@ -157,11 +303,98 @@ def play_wrapper(qlearner: Qlearner):
     qvalues_filename = qlearner.save_qval
     qlearner.save_qval = False
 
-    replay = qlearner.loop()
+    best = qlearner.loop()
     qlearner.save_replay = replay_filename
     qlearner.save_qval = qvalues_filename
 
-    return qlearner, replay
+    return qlearner, best
+
+
+shared_states = None
+
+
+def init_shared_worker(raw_states, shape):
+    global shared_states
+
+    # Forked workers start with the parent's generator state
+    random.seed()
+    shared_states = numpy.frombuffer(raw_states).reshape(shape)
+
+
+def shared_play(options):
+    sessions, no_learning, verbose, capacity, batch = options
+
+    qlearner = Qlearner(
+        max_sessions=sessions,
+        no_learning=no_learning,
+        verbose=verbose,
+        experience_buffer=experience.ExperienceBuffer(capacity)
+        if capacity
+        else None,
+        experience_batch=batch,
+    )
+    # Lock-free updates, the workers write straight into the shared table
+    qlearner.agent.states = shared_states
+
+    return qlearner.loop()
+
+
+def parallel_train(qlearner: Qlearner, processes):
+    shape = qlearner.agent.states.shape
+    raw_states = multiprocessing.RawArray("d", qlearner.agent.states.size)
+    states = numpy.frombuffer(raw_states).reshape(shape)
+    states[:] = qlearner.agent.states
+    qlearner.agent.states = states
+
+    sessions = [
+        qlearner.max_sessions // processes
+        + (index < qlearner.max_sessions % processes)
+        for index in range(processes)
+    ]
+    # Every worker keeps a buffer of its own transitions
+    capacity = 0
+    if qlearner.experience_buffer is not None:
+        capacity = qlearner.experience_buffer.capacity
+    options = [
+        (
+            count,
+            qlearner.no_learning,
+            qlearner.verbose,
+            capacity,
+            qlearner.experience_batch,
+        )
+        for count in sessions
+        if count > 0
+    ]
+    if not options:  # Nothing to split, a pool needs at least one worker
+        return qlearner.loop()
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(
+        len(options),
+        initializer=init_shared_worker,
+        initargs=(raw_states, shape),
+    ) as pool:
+        replays = pool.map(shared_play, options)
+    elapsed = time.perf_counter() - start
+
+    if not qlearner.no_learning:
+        qlearner.episodes += qlearner.max_sessions
+
+    best = max(replays, key=lambda replay: replay["score"])
+    print(
+        f"Trained {qlearner.max_sessions} sessions on {len(options)}",
+        f"processes in {elapsed:.2f}s",
+        f"({qlearner.max_sessions / elapsed:.1f} episodes/s).",
+        f"Longest size: {best['score']}",
+    )
+
+    if qlearner.save_qval:
+        qlearner.save_qvalues_file()
+    if qlearner.save_replay:
+        qlearner.save_replay_file(best)
+
+    return best
 
 
 if __name__ == "__main__":
@@ -219,6 +452,88 @@ if __name__ == "__main__":
         "If used with --replay or --output, will only create a file for" +
         "the best performing snake. Has no effect in GUI mode",
     )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=1,
+        help="Train a single shared Q table with multiple worker processes. "
+        + "Has no effect in GUI mode",
+    )
+    parser.add_argument(
+        "--replay-stream",
+        type=str,
+        default=False,
+        help="Write every episode of the run to this file as its moves are "
+        + "played, so an interrupted run keeps its last episode. "
+        + "Has no effect in GUI mode, with --threads or --processes",
+    )
+    parser.add_argument(
+        "--record",
+        type=str,
+        default=False,
+        help="Archive episodes as replays in this directory. "
+        + "Has no effect in GUI mode or with --processes",
+    )
+    parser.add_argument(
+        "--record-every",
+        type=int,
+        default=1,
+        help="Only archive every k-th episode",
+    )
+    parser.add_argument(
+        "--record-top",
+        type=int,
+        default=0,
+        help="Only archive episodes that enter the k best scores so far",
+    )
+    parser.add_argument(
+        "--record-max-size",
+        type=int,
+        default=64,
+        help="Disk budget of the episode archive in megabytes, "
+        + "the oldest episodes are deleted past it",
+    )
+    parser.add_argument(
+        "--experience",
+        type=int,
+        default=0,
+        help="Also learn from batches of the last this many moves, "
+        + "sampled from a replay buffer after every move",
+    )
+    parser.add_argument(
+        "--experience-batch",
+        type=int,
+        default=32,
+        help="The number of past moves learned from after every move",
+    )
+    parser.add_argument(
+        "--stats",
+        type=float,
+        default=False,
+        help="Report step timings and counters every this many seconds. "
+        + "Has no effect in GUI mode, with --threads or --processes",
+    )
+    parser.add_argument(
+        "--stats-output",
+        type=str,
+        default=False,
+        help="Append the --stats reports to this JSON lines file "
+        + "instead of printing them",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=False,
+        help="Run under cProfile and save its statistics to this file",
+    )
+    parser.add_argument(
+        "--steps-per-tick",
+        type=int,
+        default=100,
+        help="The number of moves played between two GUI updates when "
+        + "the speed is unlimited. Only used in GUI mode",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -228,16 +543,52 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    if args.profile:
+        run_profile = cProfile.Profile()
+        run_profile.enable()
+
+    replay_stream = None
+    if args.replay_stream and not (
+        args.gui or args.threads > 1 or args.processes > 1
+    ):
+        replay_stream = open(args.replay_stream, "wb")
+
+    episode_recorder = None
+    if args.record and not (args.gui or args.processes > 1):
+        episode_recorder = recorder.EpisodeRecorder(
+            args.record,
+            every=args.record_every,
+            top=args.record_top,
+            max_size=args.record_max_size * 1024 * 1024,
+        )
+
     if args.gui:
         import gui
 
         model = Qlearner(load_qval=args.input)
 
         user_interface = gui.GraphicalInterface(
-            model, no_learning=args.no_learning, verbose=args.verbose
+            model,
+            steps_per_tick=args.steps_per_tick,
+            no_learning=args.no_learning,
+            verbose=args.verbose,
         )
         user_interface.draw_board()
         user_interface.start_loop()
+    elif args.processes > 1:
+        qlearner = Qlearner(
+            max_sessions=args.sessions,
+            load_qval=args.input,
+            save_qval=args.output,
+            save_replay=args.replay,
+            verbose=args.verbose,
+            no_learning=args.no_learning,
+            experience_buffer=experience.ExperienceBuffer(args.experience)
+            if args.experience
+            else None,
+            experience_batch=args.experience_batch,
+        )
+        parallel_train(qlearner, args.processes)
     elif args.threads > 1:
         if args.threads > 256:
             print(f"Too many threads ({args.threads}). Maximum value is 256")
@@ -254,6 +605,11 @@ if __name__ == "__main__":
                 save_replay=args.replay,
                 verbose=args.verbose,
                 no_learning=args.no_learning,
+                episode_recorder=episode_recorder,
+                experience_buffer=experience.ExperienceBuffer(args.experience)
+                if args.experience
+                else None,
+                experience_batch=args.experience_batch,
             )
             learners.append(learner)
 
@@ -277,5 +633,28 @@ if __name__ == "__main__":
             save_replay=args.replay,
             verbose=args.verbose,
             no_learning=args.no_learning,
+            episode_recorder=episode_recorder,
+            replay_stream=replay_stream,
+            profiler=profiler.StepProfiler(args.stats, args.stats_output)
+            if args.stats
+            else None,
+            experience_buffer=experience.ExperienceBuffer(args.experience)
+            if args.experience
+            else None,
+            experience_batch=args.experience_batch,
         )
         qlearner.loop()
+
+    if episode_recorder is not None:
+        dropped = episode_recorder.close()
+        if dropped:
+            print(
+                f"{dropped} episodes were not archived,",
+                "the recorder could not keep up.",
+            )
+    if replay_stream is not None:
+        replay_stream.close()
+
+    if args.profile:
+        run_profile.disable()
+        run_profile.dump_stats(args.profile)
@@ -0,0 +1,80 @@
+import json
+import time
+
+PHASES = ["state", "choose", "move", "reward", "update"]
+
+
+class StepProfiler:
+    def __init__(self, interval=10.0, output=None):
+        self.interval = interval
+        self.output = output
+
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.steps = 0
+        self.episodes = 0
+        self.apples = {"G": 0, "R": 0}
+        self.deaths = {}
+
+        self.start = time.perf_counter()
+        self.last_emit = self.start
+        self.last_lap = self.start
+
+    def lap(self, phase):
+        # Time since the previous lap goes to phase, None only restarts it
+        now = time.perf_counter()
+        if phase is not None:
+            self.phases[phase] += now - self.last_lap
+        self.last_lap = now
+
+    def count_step(self, type_eaten):
+        self.steps += 1
+        if type_eaten in self.apples:
+            self.apples[type_eaten] += 1
+
+    def end_episode(self, game):
+        self.episodes += 1
+        cause = game.death_cause or "timeout"
+        self.deaths[cause] = self.deaths.get(cause, 0) + 1
+
+        if time.perf_counter() - self.last_emit >= self.interval:
+            self.emit()
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.start
+        return {
+            "elapsed": elapsed,
+            "steps": self.steps,
+            "episodes": self.episodes,
+            "steps_per_second": self.steps / elapsed if elapsed else 0,
+            "green_apples": self.apples["G"],
+            "red_apples": self.apples["R"],
+            "deaths": dict(self.deaths),
+            "phases": dict(self.phases),
+        }
+
+    def emit(self):
+        self.last_emit = time.perf_counter()
+        snapshot = self.snapshot()
+
+        if self.output:
+            with open(self.output, "a") as fd:
+                fd.write(json.dumps(snapshot) + "\n")
+            return
+
+        timed = sum(snapshot["phases"].values()) or 1
+        print(
+            f"[{snapshot['elapsed']:.1f}s] {snapshot['steps']} steps",
+            f"({snapshot['steps_per_second']:.0f}/s),",
+            f"{snapshot['episodes']} episodes,",
+            f"apples G {snapshot['green_apples']} R {snapshot['red_apples']},",
+            "deaths",
+            ", ".join(
+                f"{cause} {count}"
+                for cause, count in snapshot["deaths"].items()
+            ),
+            "| time",
+            ", ".join(
+                f"{phase} {seconds / timed:.0%}"
+                for phase, seconds in snapshot["phases"].items()
+            ),
+        )
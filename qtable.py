@@ -0,0 +1,93 @@
+import numpy
+import json
+import struct
+
+import argparse
+
+MAGIC = b"L2SQVAL\x01"
+HEADER_LENGTH = struct.Struct("<I")
+DATA_ALIGNMENT = 64
+
+
+def save_qvalues(filename, states, metadata=None):
+    # Copy first, the source may be a map of the file being overwritten
+    states = numpy.array(states, dtype="<f8")
+
+    header = dict(metadata or {})
+    header["dtype"] = states.dtype.str
+    header["shape"] = list(states.shape)
+    header = json.dumps(header).encode()
+
+    # Pad the header so the table starts on an aligned offset for mmap
+    prefix_length = len(MAGIC) + HEADER_LENGTH.size
+    padding = -(prefix_length + len(header)) % DATA_ALIGNMENT
+    header += b" " * padding
+
+    with open(filename, "wb") as fd:
+        fd.write(MAGIC)
+        fd.write(HEADER_LENGTH.pack(len(header)))
+        fd.write(header)
+        fd.write(states.tobytes())
+
+
+def read_header(fd):
+    if fd.read(len(MAGIC)) != MAGIC:
+        return None, 0
+
+    (header_length,) = HEADER_LENGTH.unpack(fd.read(HEADER_LENGTH.size))
+    header = json.loads(fd.read(header_length))
+    return header, len(MAGIC) + HEADER_LENGTH.size + header_length
+
+
+def load_qvalues(filename, mmap=False):
+    with open(filename, "rb") as fd:
+        header, offset = read_header(fd)
+
+    # Plain text tables saved by older versions carry no metadata
+    if header is None:
+        return numpy.loadtxt(filename), {}
+
+    dtype = numpy.dtype(header.pop("dtype"))
+    shape = tuple(header.pop("shape"))
+
+    if mmap:
+        states = numpy.memmap(
+            filename, dtype=dtype, mode="r", offset=offset, shape=shape
+        )
+    else:
+        states = numpy.fromfile(filename, dtype=dtype, offset=offset)
+        states = states.reshape(shape)
+
+    return states, header
+
+
+def convert(input_filename, output_filename, vision_length):
+    import interpreter
+
+    states, metadata = load_qvalues(input_filename)
+
+    metadata.setdefault("vision_length", vision_length)
+    metadata.setdefault("actions", interpreter.ACTIONS)
+    metadata.setdefault("values", interpreter.VALUES)
+    metadata.setdefault("rewards", interpreter.REWARDS)
+
+    save_qvalues(output_filename, states, metadata)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Learn2slither Q table converter",
+        description="Convert a Q values file to the binary model format",
+    )
+    parser.add_argument("input", type=str, help="The file to convert")
+    parser.add_argument("output", type=str, help="The file to write")
+    parser.add_argument(
+        "-l",
+        "--vision-length",
+        type=int,
+        default=1,
+        help="The vision length the Q values were trained with",
+    )
+
+    args = parser.parse_args()
+    convert(args.input, args.output, args.vision_length)
@@ -0,0 +1,129 @@
+import replay
+import heapq
+import os
+import queue
+import threading
+
+SEGMENT_PREFIX = "episodes-"
+SEGMENT_SUFFIX = ".rpla"
+
+
+class EpisodeRecorder:
+    def __init__(
+        self,
+        directory,
+        every=1,
+        top=0,
+        max_size=64 * 1024 * 1024,
+        max_segments=8,
+        queue_size=4096,
+    ):
+        self.directory = directory
+        self.every = every
+        self.top = top
+        self.segment_size = max(max_size // max_segments, 1)
+        self.max_segments = max_segments
+
+        self.episodes = 0
+        self.dropped = 0
+        self.best_scores = []
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        segments = self.list_segments()
+        self.segment_index = 0
+        if segments:
+            self.segment_index = int(
+                segments[-1]
+                .removeprefix(SEGMENT_PREFIX)
+                .removesuffix(SEGMENT_SUFFIX)
+            )
+        self.segment = None
+
+        # Writes happen on a background thread, the training loop only
+        # hands over finished episodes
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def record(self, header, actions, trailer):
+        with self.lock:
+            self.episodes += 1
+            if self.episodes % self.every:
+                return
+
+            if self.top:
+                score = trailer["score"]
+                if len(self.best_scores) < self.top:
+                    heapq.heappush(self.best_scores, score)
+                elif score > self.best_scores[0]:
+                    heapq.heapreplace(self.best_scores, score)
+                else:
+                    return
+
+            trailer = dict(trailer, episode=self.episodes)
+            try:
+                self.queue.put_nowait((header, bytes(actions), trailer))
+            except queue.Full:
+                self.dropped += 1
+
+    def write_loop(self):
+        while True:
+            episode = self.queue.get()
+            if episode is None:
+                break
+
+            header, actions, trailer = episode
+            if self.segment is None:
+                self.open_segment()
+
+            writer = replay.ReplayWriter(self.segment, header)
+            writer.extend(actions)
+            writer.close(trailer)
+            self.segment.flush()
+
+            if self.segment.tell() >= self.segment_size:
+                self.segment.close()
+                self.segment = None
+
+        if self.segment is not None:
+            self.segment.close()
+
+    def list_segments(self):
+        return sorted(
+            filename
+            for filename in os.listdir(self.directory)
+            if filename.startswith(SEGMENT_PREFIX)
+            and filename.endswith(SEGMENT_SUFFIX)
+        )
+
+    def open_segment(self):
+        self.segment_index += 1
+        filename = f"{SEGMENT_PREFIX}{self.segment_index:06d}{SEGMENT_SUFFIX}"
+        self.segment = open(os.path.join(self.directory, filename), "wb")
+
+        # Drop the oldest segments to stay within the size budget
+        segments = self.list_segments()
+        for old_segment in segments[: -self.max_segments]:
+            os.remove(os.path.join(self.directory, old_segment))
+
+    def close(self):
+        # Returns the number of episodes lost to a full queue
+        self.queue.put(None)
+        self.thread.join()
+        return self.dropped
+
+
+def read_segment(filename):
+    with open(filename, "rb") as fd:
+        while fd.peek(1):
+            try:
+                reader = replay.ReplayReader(fd)
+            except ValueError:  # Cut short inside the next episode's magic
+                break
+            if reader.header is None:
+                break
+            actions = list(reader.actions())
+            yield reader.header, actions, reader.trailer
+            if reader.trailer is None:  # Cut short by a crash
+                break
@@ -0,0 +1,252 @@
+import board
+import numpy
+import json
+import struct
+
+import argparse
+
+MAGIC = b"L2SREPL\x01"
+JSON_LENGTH = struct.Struct("<I")
+BLOCK_LENGTH = struct.Struct("<H")
+BLOCK_ACTIONS = 1024
+KEYFRAME_INTERVAL = 100
+
+DIRECTIONS = [[0, -1], [0, 1], [-1, 0], [1, 0]]
+
+
+def write_json(fd, data):
+    data = json.dumps(data).encode()
+    fd.write(JSON_LENGTH.pack(len(data)))
+    fd.write(data)
+
+
+def read_json(fd):
+    length = fd.read(JSON_LENGTH.size)
+    if len(length) < JSON_LENGTH.size:
+        return None
+
+    (length,) = JSON_LENGTH.unpack(length)
+    data = fd.read(length)
+    if len(data) < length:
+        return None
+
+    # Treated like a truncation, for files cut short and overwritten
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+def pack_actions(actions):
+    # Four 2 bit action codes per byte, first action in the low bits
+    count = len(actions)
+    codes = numpy.zeros(-(-count // 4) * 4, dtype=numpy.uint8)
+    codes[:count] = numpy.frombuffer(bytes(actions), dtype=numpy.uint8)
+    codes = codes.reshape(-1, 4)
+    return (
+        codes[:, 0] | codes[:, 1] << 2 | codes[:, 2] << 4 | codes[:, 3] << 6
+    ).tobytes()
+
+
+def unpack_actions(packed, count):
+    packed = numpy.frombuffer(packed, dtype=numpy.uint8)
+    codes = numpy.stack([(packed >> shift) & 3 for shift in range(0, 8, 2)])
+    return codes.T.ravel()[:count].tolist()
+
+
+class ReplayWriter:
+    def __init__(self, fd, header):
+        self.fd = fd
+        self.pending = bytearray()
+
+        fd.write(MAGIC)
+        write_json(fd, header)
+
+    def add(self, action):
+        self.pending.append(action)
+        if len(self.pending) >= BLOCK_ACTIONS:
+            self.flush()
+
+    def extend(self, actions):
+        self.pending += actions
+        if len(self.pending) >= BLOCK_ACTIONS:
+            self.flush()
+
+    def flush(self):
+        # Blocks are self-delimited so a reader can stop at any of them
+        for start in range(0, len(self.pending), BLOCK_ACTIONS):
+            end = start + BLOCK_ACTIONS
+            block = self.pending[start:end]
+            self.fd.write(BLOCK_LENGTH.pack(len(block)))
+            self.fd.write(pack_actions(block))
+        self.pending = bytearray()
+        self.fd.flush()
+
+    def close(self, trailer=None):
+        self.flush()
+        self.fd.write(BLOCK_LENGTH.pack(0))
+        write_json(self.fd, trailer or {})
+        self.fd.flush()
+
+
+class ReplayReader:
+    def __init__(self, fd):
+        if fd.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a replay file")
+
+        self.fd = fd
+        self.header = read_json(fd)
+        self.trailer = None
+
+    def actions(self):
+        while True:
+            length = self.fd.read(BLOCK_LENGTH.size)
+            if len(length) < BLOCK_LENGTH.size:  # Truncated replay
+                return
+
+            (count,) = BLOCK_LENGTH.unpack(length)
+            if count == 0:
+                break
+
+            yield from unpack_actions(self.fd.read(-(-count // 4)), count)
+
+        self.trailer = read_json(self.fd)
+
+
+def board_header(game: board.Board):
+    return {
+        "board_size": game.board_size,
+        "green_apples_count": game.green_apples_count,
+        "red_apples_count": game.red_apples_count,
+        "snake_size": game.snake_size,
+        "seed": game.rngseed,
+    }
+
+
+def header_board(header):
+    game = board.Board(
+        board_size=header["board_size"],
+        green_apples_count=header["green_apples_count"],
+        red_apples_count=header["red_apples_count"],
+        snake_size=header["snake_size"],
+        seed=header["seed"],
+    )
+
+    # The seed alone rebuilds the starting board, older binary replays
+    # also listed the starting positions
+    if "snake" in header:
+        game.set_positions(
+            header["snake"], header["green_apples"], header["red_apples"]
+        )
+    return game
+
+
+def play_actions(game: board.Board, actions):
+    for action in actions:
+        if game.lost:
+            break
+        game.move_snake(DIRECTIONS[action])
+    return game
+
+
+class ReplayPlayer:
+    def __init__(self, game: board.Board, actions, interval=KEYFRAME_INTERVAL):
+        self.actions = actions
+        self.interval = interval
+
+        # Play the replay once, keeping a snapshot of the board every
+        # interval moves to seek from
+        self.keyframes = []
+        game = board.Board.from_snapshot(game.snapshot())
+        self.length = 0
+        for action in actions:
+            if self.length == len(self.keyframes) * interval:
+                self.keyframes.append(game.snapshot())
+            if game.lost:
+                break
+            game.move_snake(DIRECTIONS[action])
+            self.length += 1
+        if self.length == len(self.keyframes) * interval:
+            self.keyframes.append(game.snapshot())
+
+        self.position = 0
+        self.board = board.Board.from_snapshot(self.keyframes[0])
+        self.revision = self.board.revision
+
+    def seek(self, position):
+        position = min(max(position, 0), self.length)
+
+        # Going back, far ahead, or on a board moved since, starts again from
+        # the nearest keyframe
+        if (
+            position < self.position
+            or position // self.interval > self.position // self.interval
+            or self.board.revision != self.revision
+        ):
+            keyframe = position // self.interval
+            self.board.restore(self.keyframes[keyframe])
+            self.position = keyframe * self.interval
+
+        start = self.position
+        for action in self.actions[start:position]:
+            self.board.move_snake(DIRECTIONS[action])
+        self.position = position
+        self.revision = self.board.revision
+
+        return self.board
+
+    def forward(self):
+        return self.seek(self.position + 1)
+
+    def back(self):
+        return self.seek(self.position - 1)
+
+
+def verify_replay(filename):
+    game, actions, trailer = load_replay(filename)
+
+    if not trailer or "hash" not in trailer:
+        return None
+    return play_actions(game, actions).state_hash() == trailer["hash"]
+
+
+def write_replay(filename, header, actions, trailer=None):
+    with open(filename, "wb") as fd:
+        writer = ReplayWriter(fd, header)
+        writer.extend(actions)
+        writer.close(trailer)
+
+
+def load_replay(filename):
+    with open(filename, "rb") as fd:
+        # Replays used to be JSON documents with the whole starting grid
+        if fd.read(1) == b"{":
+            fd.seek(0)
+            replay_data = json.load(fd)
+
+            game = board.Board()
+            game.set_board(replay_data)
+            actions = [
+                DIRECTIONS.index(direction)
+                for direction in replay_data["inputs"]
+            ]
+            return game, actions, replay_data
+
+        fd.seek(0)
+        reader = ReplayReader(fd)
+        actions = list(reader.actions())
+        return header_board(reader.header), actions, reader.trailer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Learn2slither replay checker",
+        description="Replay episodes and check their final board state",
+    )
+    parser.add_argument("replays", nargs="+", help="The replay files")
+
+    args = parser.parse_args()
+
+    results = {True: "OK", False: "MISMATCH", None: "NO HASH"}
+    for filename in args.replays:
+        print(f"{filename}: {results[verify_replay(filename)]}")